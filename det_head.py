@@ -14,15 +14,47 @@ class CenterPointHead(nn.Module):
         self.shared_conv = SeparateHead(in_channels,shared_conv_channel,num_shared_convs,bn)
         self.heatmap_head = SeparateHead(shared_conv_channel, num_classes, num_seperate_convs, bn, init_bias=init_bias)
         self.regression_head = SeparateHead(shared_conv_channel, num_task_channel, num_seperate_convs, bn)
+        # merged first conv of both branches, only built by fuse()
+        self.task_conv = None
+        self.task_channels = [0, 0]
 
     def forward(self,x):
         x = self.shared_conv(x)
-        heatmap = self.heatmap_head(x)
-        regression  = self.regression_head(x)
+        if self.task_conv is not None:
+            task_x = self.task_conv(x).split(self.task_channels, dim=1)
+            heatmap_x = task_x[0]
+            regression_x = task_x[1]
+        else:
+            heatmap_x = x
+            regression_x = x
+        heatmap = self.heatmap_head(heatmap_x)
+        regression  = self.regression_head(regression_x)
         return heatmap,regression
 
+    def fuse(self):
+        for head in (self.shared_conv, self.heatmap_head, self.regression_head):
+            head.fuse()
+        # both branches open with a conv(+relu) on the same input, once bn is folded run them as one conv
+        # and split its output. done at fuse time so the state_dict and init stay per-branch
+        heatmap_first, regression_first = self.heatmap_head.conv_layers[0], self.regression_head.conv_layers[0]
+        relu = isinstance(heatmap_first, nn.Sequential)
+        heatmap_conv = heatmap_first[0] if relu else heatmap_first
+        regression_conv = regression_first[0] if relu else regression_first
+        conv = nn.Conv2d(heatmap_conv.in_channels, heatmap_conv.out_channels+regression_conv.out_channels,
+                kernel_size=heatmap_conv.kernel_size, stride=heatmap_conv.stride,
+                padding=heatmap_conv.padding, bias=True).to(heatmap_conv.weight.device)
+        conv.weight.data = torch.cat([heatmap_conv.weight.data, regression_conv.weight.data])
+        conv.bias.data = torch.cat([heatmap_conv.bias.data, regression_conv.bias.data])
+        self.task_conv = nn.Sequential(conv, nn.ReLU()) if relu else conv
+        self.task_channels = [heatmap_conv.out_channels, regression_conv.out_channels]
+        self.heatmap_head.conv_layers[0] = nn.Identity()
+        self.regression_head.conv_layers[0] = nn.Identity()
+        return self
+
 if __name__ == "__main__":
     x = torch.zeros(4,64,128,128)
     net = CenterPointHead(64,10)
     res = net(x)
-    print(res[0].shape,res[1].shape)
\ No newline at end of file
+    print(res[0].shape,res[1].shape)
+    res = net.eval().fuse()(x)
+    print(res[0].shape,res[1].shape)
@@ -1,14 +1,22 @@
+from typing import List
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.ao.quantization import fuse_modules
 
 class FPN(nn.Module):
+    # declared here, torchscript ignores annotations on empty containers assigned in __init__
+    upsample_sizes: List[List[int]]
+
     def __init__(self, in_channels, out_channels=512, out_ids=[0]):
         super().__init__()
         self.in_channels = in_channels
         self.lateral_convs = nn.ModuleList()
         self.fpn_convs = nn.ModuleList()
-        self.out_ids = out_ids
+        # fpn_convs are built in level order, keep out_ids in the same order so they can be zipped
+        self.out_ids = [i for i in range(len(in_channels)) if i in out_ids]
+        # upsample target of every level but the last, filled by set_input_size
+        self.upsample_sizes = []
         for _,in_channel in enumerate(in_channels):
             lateral_conv = nn.Sequential(
                 nn.Conv2d(in_channel,out_channels,1, padding=0, bias=False),
@@ -29,18 +37,35 @@ class FPN(nn.Module):
                 nn.init.constant_(m.weight, 1)
                 nn.init.constant_(m.bias, 0)
                 
-    def forward(self, inputs):
+    def forward(self, inputs: List[torch.Tensor]):
         assert len(inputs) == len(self.in_channels)
-        laterals = [
-            lateral_conv(inputs[i])
-            for i, lateral_conv in enumerate(self.lateral_convs)
-        ]
+        # plain loops over the ModuleLists (no comprehensions or integer indexing) keep the fpn scriptable
+        laterals = []
+        for i, lateral_conv in enumerate(self.lateral_convs):
+            laterals.append(lateral_conv(inputs[i]))
         for i in range(len(laterals)-1,0,-1):
-            prev_shape = laterals[i - 1].shape[2:]
+            if len(self.upsample_sizes) > 0:
+                prev_shape = self.upsample_sizes[i - 1]
+            else:
+                prev_shape = laterals[i - 1].shape[2:]
+            # out-of-place add, lets jit fuse the upsample+add
             laterals[i - 1] = F.interpolate(laterals[i], size=prev_shape)+laterals[i - 1]
-        outs = [self.fpn_convs[i](laterals[i]) for i in self.out_ids]
+        outs = []
+        for i, fpn_conv in zip(self.out_ids, self.fpn_convs):
+            outs.append(fpn_conv(laterals[i]))
         return outs
 
+    def set_input_size(self, hws_per_level):
+        '''cache the upsample sizes for a fixed input, hws_per_level: (h, w) of every input level'''
+        assert len(hws_per_level) == len(self.in_channels)
+        self.upsample_sizes = [[int(h), int(w)] for h, w in hws_per_level[:-1]]
+
+    def fuse(self):
+        # fold conv+bn+relu into a single conv, only valid in eval mode
+        for conv in [*self.lateral_convs, *self.fpn_convs]:
+            fuse_modules(conv, [['0', '1', '2']], inplace=True)
+        return self
+
 if __name__ == "__main__":
     input1 = [torch.zeros(6,56,80,80),
             torch.zeros(6,152,40,40),
@@ -53,4 +78,6 @@ if __name__ == "__main__":
             torch.zeros(4,368,32,32)]
     net2 = FPN(in_channels=[152,368],out_channels=64,out_ids=[0])
     output2 = net2(input2)
-    print([i.shape for i in output2])
\ No newline at end of file
+    print([i.shape for i in output2])
+    scripted = torch.jit.script(net2.eval().fuse())
+    print([i.shape for i in scripted(input2)])
\ No newline at end of file
@@ -19,7 +19,8 @@ class GridSampler(nn.Module):
         self.norm_mesh_y = (self.mesh_y-input_grid_conf['ybound'][0]) / (input_grid_conf['ybound'][1]-input_grid_conf['ybound'][0])*2-1
         
         #remember xy coordination of grid_conf(where x is forward,y is left) is different from torch.grid_sample(where x is right,y is backward)
-        self.mesh_grid = torch.stack(torch.meshgrid(-self.norm_mesh_x, -self.norm_mesh_y, indexing='ij'), dim=2)
+        # registered as a buffer so it follows the module across .to(device) instead of being copied every forward
+        self.register_buffer('mesh_grid', torch.stack(torch.meshgrid(-self.norm_mesh_x, -self.norm_mesh_y, indexing='ij'), dim=2), persistent=False)
 
     def forward(self, x):
         # x: bev feature mesh tensor of shape (b, c, h, w)
@@ -27,6 +28,17 @@ class GridSampler(nn.Module):
         result = F.grid_sample(x, grid=grid, mode='bilinear', align_corners=True)
         return result
 
+def multi_grid_sample(x, grid_samplers):
+    '''sample the target grids of several GridSamplers from the same bev feature with one grid_sample call'''
+    grid_samplers = list(grid_samplers)
+    shapes = [grid_sampler.mesh_grid.shape[:2] for grid_sampler in grid_samplers]
+    # flatten every target grid into one row so all tasks share a single kernel launch
+    grid = torch.cat([grid_sampler.mesh_grid.reshape(1, 1, -1, 2) for grid_sampler in grid_samplers], dim=2)
+    grid = grid.type_as(x).expand(x.shape[0], -1, -1, -1)
+    result = F.grid_sample(x, grid=grid, mode='bilinear', align_corners=True)
+    results = result.split([h*w for h, w in shapes], dim=3)
+    return [res.reshape(*x.shape[:2], h, w) for res, (h, w) in zip(results, shapes)]
+
 if __name__ == "__main__":
     base_grid = {
         'xbound': [-10.0, 50.0, 0.125],
@@ -50,3 +62,5 @@ if __name__ == "__main__":
         net = GridSampler(base_grid,conf)
         res[name] = net(input)
     print([i.shape for i in res.values()])
+    nets = [GridSampler(base_grid,conf) for conf in task_grids.values()]
+    print([i.shape for i in multi_grid_sample(input, nets)])
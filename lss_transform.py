@@ -19,11 +19,19 @@ class LSSTransform(nn.Module):
 
         self.frustum = self.create_frustum()
         self.D, _, _, _ = self.frustum.shape
+        # 将像素坐标(u,v,1)根据深度d变成齐次坐标(du,dv,d)
+        # the frustum is constant, so this is built once here instead of concatenated on every get_geometry
+        self.frustum_points = torch.cat((self.frustum[..., :2] * self.frustum[..., 2:3],
+                                         self.frustum[..., 2:3]), -1)
         self.numC_input = numC_input
         self.numC_trans = numC_trans
         self.depthnet = nn.Conv2d(
             self.numC_input, self.D + self.numC_trans, kernel_size=1, padding=0)
         self.use_quickcumsum = use_quickcumsum
+        # voxel indices of the last camera params, see prepare_geometry
+        self._geom_cams = None
+        self._geom_key = None
+        self._geom_cache = None
 
         for m in self.modules():
             if isinstance(m, nn.Conv2d):
@@ -48,6 +56,8 @@ class LSSTransform(nn.Module):
         frustum = torch.stack((xs, ys, ds), -1)
         return frustum
 
+    # pixel*depth coordinates reach tens of thousands, far beyond fp16 precision, keep them in fp32
+    @torch.autocast("cuda", enabled=False)
     def get_geometry(self, rots, trans, intrins):
         """Determine the (x,y,z) locations (in the ego frame)
         of the points in the point cloud.
@@ -56,11 +66,8 @@ class LSSTransform(nn.Module):
 
         N = trans.shape[1]
 
-        points = self.frustum.unsqueeze(0).unsqueeze(0).unsqueeze(-1)
         # cam_to_ego
-        points = torch.cat((points[:, :, :, :, :, :2] * points[:, :, :, :, :, 2:3],
-                            points[:, :, :, :, :, 2:3]
-                            ), 5) # 将像素坐标(u,v,1)根据深度d变成齐次坐标(du,dv,d)
+        points = self.frustum_points.unsqueeze(0).unsqueeze(0).unsqueeze(-1)
 
         # flatten (batch & sequence)
         rots = rots.flatten(0, 1).to(points.device)
@@ -80,16 +87,17 @@ class LSSTransform(nn.Module):
         x = self.depthnet(x)
 
         # 前D个通道估计深度
-        depth = self.get_depth_dist(x[:, :self.D])
+        depth = self.get_depth_dist(x[:, :self.D]).contiguous()
 
         # 后numC_trans个通道提取特征
         cvt_feature = x[:, self.D:(self.D + self.numC_trans)]
 
         # 深度乘特征，见LSS论文
-        volume = depth.unsqueeze(1) * cvt_feature.unsqueeze(2)
+        # built directly in (B*N, D, H, W, C) order, the layout voxel pooling flattens to,
+        # so the reshapes here and in voxel pooling are views instead of copies of the whole volume
+        volume = depth.unsqueeze(-1) * cvt_feature.permute(0, 2, 3, 1).unsqueeze(1)
 
-        volume = volume.reshape(B, N, self.numC_trans, self.D, H, W)
-        volume = volume.permute(0, 1, 3, 4, 5, 2)
+        volume = volume.reshape(B, N, self.D, H, W, self.numC_trans)
         return volume
 
     def voxel_pooling_prepare(self, geom):
@@ -104,8 +112,7 @@ class LSSTransform(nn.Module):
 
         # 将像素映射关系同样展平，一共有(B*N*D*H*W)个点 
         geom_grid = geom_grid.reshape(-1, 3)
-        batch_ix = torch.cat([torch.full([geom_grid.shape[0]//B,1], ix,
-                                         device=geom_grid.device, dtype=torch.long) for ix in range(B)])
+        batch_ix = torch.arange(B, device=geom_grid.device).repeat_interleave(geom_grid.shape[0]//B).unsqueeze(1)
 
         geom_grid = torch.cat((geom_grid, batch_ix), 1)
 
@@ -129,9 +136,30 @@ class LSSTransform(nn.Module):
         ranks = ranks[sorts]
         return geom_grid,ranks,kept,sorts
 
-    def voxel_pooling(self, geom, x):
+    def prepare_geometry(self, rots, trans, intrins, device):
+        # camera params rarely change between calls, so the sorted voxel indices are reused for as long as
+        # the very same tensors come back unmodified. holding references to them also keeps their memory
+        # from being recycled into a different tensor that would look identical
+        cams = (rots, trans, intrins)
+        # every training batch brings new camera tensors, caching would only keep the last ones alive.
+        # inference tensors have no version counter, in-place edits to them can't be detected
+        if self.training or any(t.is_inference() for t in cams):
+            geom = self.get_geometry(rots, trans, intrins)
+            return [t.to(device) for t in self.voxel_pooling_prepare(geom)]
+        # the grid params are part of the state_dict, load_state_dict bumps their versions
+        key = (tuple(t._version for t in cams + (self.lower_bound, self.interval, self.count)),
+               device, torch.is_inference_mode_enabled())
+        if self._geom_cams is None or any(a is not b for a, b in zip(cams, self._geom_cams)) or key != self._geom_key:
+            # 每个像素对应的视锥体的车体坐标[B, N, D, H, W, 3]
+            geom = self.get_geometry(rots, trans, intrins)
+            self._geom_cache = [t.to(device) for t in self.voxel_pooling_prepare(geom)]
+            self._geom_cams = cams
+            self._geom_key = key
+        return self._geom_cache
+
+    def voxel_pooling(self, prepared, x):
         B, N, D, H, W, C = x.shape
-        geom,ranks,kept,sorts = self.voxel_pooling_prepare(geom)
+        geom,ranks,kept,sorts = prepared
         
         # flatten x
         # 将图像特征展平，一共有 (B*N*D*H*W)*C个点
@@ -147,29 +175,29 @@ class LSSTransform(nn.Module):
             # cumsum trick
             x, geom = cumsum_trick(x, geom, ranks)
 
-        # griddify (B x C x Z x X x Y)
+        # griddify (B x Z x C x X x Y)
         # 将x按照栅格坐标放到final中
         count = self.count.long()
-        final = torch.zeros((B, C, count[2], count[0], count[1]), device=x.device)
+        final = torch.zeros((B, count[2], C, count[0], count[1]), dtype=x.dtype, device=x.device)
 
-        final[geom[:, 3], :, geom[:, 2],
+        final[geom[:, 3], geom[:, 2], :,
               geom[:, 0], geom[:, 1]] = x
 
         # collapse Z
         # 消除掉z维
-        final = torch.cat(final.unbind(dim=2), 1)
+        # Z is laid out before C, so this is a view with the same z-major channel order a cat over Z would give
+        final = final.reshape(B, -1, count[0], count[1])
 
         return final
 
     def forward(self, x, rots, trans, intrins):
-        # 每个像素对应的视锥体的车体坐标[B, N, D, H, W, 3]
-        geom = self.get_geometry(rots, trans, intrins)
+        prepared = self.prepare_geometry(rots, trans, intrins, x.device)
 
         # 每个特征图上的像素对应的深度上的特征
         volume = self.get_volume(x)
 
         # 将图像特征沿着pillars方向进行sum pooling，其中使用了cumsum trick，参考LSS论文4.2节
-        bev_feat = self.voxel_pooling(geom, volume)
+        bev_feat = self.voxel_pooling(prepared, volume)
 
         return bev_feat
 
@@ -198,17 +226,18 @@ class LSSTransformWithFixedParam(LSSTransform):
             # cumsum trick
             x, geom = cumsum_trick(x, geom, ranks)
 
-        # griddify (B x C x Z x X x Y)
+        # griddify (B x Z x C x X x Y)
         # 将x按照栅格坐标放到final中
         count = self.count.long()
-        bev_feat = torch.zeros((B, C, count[2], count[0], count[1]), device=x.device)
+        bev_feat = torch.zeros((B, count[2], C, count[0], count[1]), dtype=x.dtype, device=x.device)
 
-        bev_feat[geom[:, 3], :, geom[:, 2],
+        bev_feat[geom[:, 3], geom[:, 2], :,
               geom[:, 0], geom[:, 1]] = x
 
         # collapse Z
         # 消除掉z维
-        bev_feat = torch.cat(bev_feat.unbind(dim=2), 1)
+        # Z is laid out before C, so this is a view with the same z-major channel order a cat over Z would give
+        bev_feat = bev_feat.reshape(B, -1, count[0], count[1])
         return bev_feat
 
 def cumsum_trick(x, geom, ranks):
@@ -1,13 +1,18 @@
 import torch
 import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx,convert_fx
 from regnet import regnetx_002
 from fpn import FPN
 from lss_transform import LSSTransform,LSSTransformWithFixedParam
-from grid_sampler import GridSampler
+from grid_sampler import GridSampler,multi_grid_sample
 from det_head import CenterPointHead
 from seg_head import VanillaSegmentHead
 
 class BEVerse(nn.Module):
+    # everything but the lss transform, whose voxel pooling has data dependent shapes
+    conv_stages = ('image_encoder', 'image_fpn', 'bev_encoder', 'bev_fpn', 'det_head', 'seg_head')
+
     def __init__(self,grid_confs,num_det_classes=10,num_seg_classes=10,num_images=6,image_size=(640,640)):
         super().__init__()
         self.image_encoder = regnetx_002()
@@ -18,46 +23,87 @@ class BEVerse(nn.Module):
         self.lss_transformer = LSSTransform(grid_conf=self.grid_conf,image_size=self.image_size,numC_input=64,numC_trans=64,downsample=8)
         self.bev_encoder = regnetx_002(input_channel=64,out_indices=[2,3],replace_stride_with_dilation=[True,True,True,False])
         self.bev_fpn = FPN(in_channels=[152,368],out_channels=64,out_ids=[0])
-        self.grid_samplers = {}
-        for task,conf in grid_confs.items():
-            self.grid_samplers[task] = GridSampler(self.grid_conf,conf)
+        # input sizes are fixed, so the fpn upsample sizes can be worked out once here
+        self.image_fpn.set_input_size(self.image_encoder.feature_sizes(self.image_size))
+        self.bev_fpn.set_input_size(self.bev_encoder.feature_sizes(self.lss_transformer.count[:2].long().tolist()))
+        # only the grids the heads consume, 'base' is the lss grid itself
+        self.grid_samplers = nn.ModuleDict({task:GridSampler(self.grid_conf,grid_confs[task]) for task in ('det','seg')})
         self.det_head = CenterPointHead(64,num_det_classes)
         self.seg_head = VanillaSegmentHead(64,num_seg_classes)
         self.num_images = num_images
+        # NHWC lets cudnn pick its native channels_last kernels instead of transposing around every conv
+        self.to(memory_format=torch.channels_last)
 
     def forward(self, x, rots, trans, intrins):
-        x = x.reshape(-1,*x.shape[2:])
+        x = x.flatten(0,1).contiguous(memory_format=torch.channels_last)
         image_feature = self.image_encoder(x)
         image_fpn_feature = self.image_fpn(image_feature)[0]
-        image_fpn_feature = image_fpn_feature.reshape(-1,self.num_images,*image_fpn_feature.shape[1:])
+        image_fpn_feature = image_fpn_feature.unflatten(0,(-1,self.num_images))
         lss_feature = self.lss_transformer(image_fpn_feature,rots,trans,intrins)
+        lss_feature = lss_feature.contiguous(memory_format=torch.channels_last)
         bev_feature = self.bev_encoder(lss_feature)
         bev_fpn_feature = self.bev_fpn(bev_feature)[0]
-        grid_cells = {}
-        for task,grid_sampler in self.grid_samplers.items():
-            grid_cells[task] = grid_sampler(bev_fpn_feature)
+        grid_cells = dict(zip(self.grid_samplers, multi_grid_sample(bev_fpn_feature, self.grid_samplers.values())))
         det_res = self.det_head(grid_cells['det'])
         heatmap = det_res[0]
         regression = det_res[1]
         seg_res = self.seg_head(grid_cells['seg'])
         return heatmap,regression,seg_res
 
+    def fuse(self):
+        '''fold batchnorm into the convs for inference, call after eval()'''
+        for name in self.conv_stages:
+            getattr(self, name).fuse()
+        return self.to(memory_format=torch.channels_last)
+
+    def quantize(self, calibration_data, backend='fbgemm'):
+        '''int8 static quantization of the image and bev encoders for cpu inference, call after eval()
+        calibration_data: iterable of forward argument tuples, must be representative of real inputs
+        since the observers take their activation ranges from it
+        the caller sets torch.backends.quantized.engine to the same backend before running the result
+        the default qconfig quantizes conv weights symmetric per-channel'''
+        qconfig_mapping = get_default_qconfig_mapping(backend)
+        count = self.lss_transformer.count.long().tolist()
+        image_example = torch.zeros(1,3,*self.image_size)
+        bev_example = torch.zeros(1,self.lss_transformer.numC_trans*count[2],count[0],count[1])
+        self.image_encoder = prepare_fx(self.image_encoder, qconfig_mapping, (image_example,))
+        self.bev_encoder = prepare_fx(self.bev_encoder, qconfig_mapping, (bev_example,))
+        with torch.no_grad():
+            for data in calibration_data:
+                self(*data)
+        self.image_encoder = convert_fx(self.image_encoder)
+        self.bev_encoder = convert_fx(self.bev_encoder)
+        return self
+
+    def compile_convs(self, mode='max-autotune'):
+        '''compile the conv stages with inductor for fixed input shapes, call after fuse()'''
+        for name in self.conv_stages:
+            setattr(self, name, torch.compile(getattr(self, name), mode=mode, dynamic=False))
+        return self
+
+    def freeze_convs(self):
+        '''script and freeze the conv stages, call after eval() and fuse()
+        freezing lets jit see the folded conv+bias followed by relu and run it as one fused conv'''
+        for name in self.conv_stages:
+            setattr(self, name, torch.jit.optimize_for_inference(torch.jit.script(getattr(self, name))))
+        return self
+
 class BEVerseWithFixedParam(BEVerse):
     def __init__(self,rots,trans,intrins,**kwargs):
         super().__init__(**kwargs)
         self.lss_transformer = LSSTransformWithFixedParam(rots,trans,intrins,image_size=self.image_size,numC_input=64,numC_trans=64,downsample=8,grid_conf=self.grid_conf)
+        self.lss_transformer.to(memory_format=torch.channels_last)
     
     def forward(self, x):
-        x = x.reshape(-1,*x.shape[2:])
+        x = x.flatten(0,1).contiguous(memory_format=torch.channels_last)
         image_feature = self.image_encoder(x)
         image_fpn_feature = self.image_fpn(image_feature)[0]
-        image_fpn_feature = image_fpn_feature.reshape(-1,self.num_images,*image_fpn_feature.shape[1:])
+        image_fpn_feature = image_fpn_feature.unflatten(0,(-1,self.num_images))
         lss_feature = self.lss_transformer(image_fpn_feature)
+        lss_feature = lss_feature.contiguous(memory_format=torch.channels_last)
         bev_feature = self.bev_encoder(lss_feature)
         bev_fpn_feature = self.bev_fpn(bev_feature)[0]
-        grid_cells = {}
-        for task,grid_sampler in self.grid_samplers.items():
-            grid_cells[task] = grid_sampler(bev_fpn_feature)
+        grid_cells = dict(zip(self.grid_samplers, multi_grid_sample(bev_fpn_feature, self.grid_samplers.values())))
         det_res = self.det_head(grid_cells['det'])
         seg_res = self.seg_head(grid_cells['seg'])
         return det_res,seg_res
@@ -81,26 +127,60 @@ if __name__ == '__main__':
     }
     }
     import time
-    device = torch.device("cpu")
-    x = torch.zeros(2,6,3,640,640).to(device)
-    rots = torch.zeros(2,6,3,3)
-    trans =torch.zeros(2,6,3)
-    intrins = torch.zeros(2,6,3,3)
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    # input shapes are fixed, let cudnn autotune its conv algorithms once
+    torch.backends.cudnn.benchmark = True
+    # tf32 tensor cores for whatever autocast leaves in fp32
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    use_amp = device.type == "cuda"
+    # page-locked host memory so the copies below can run asynchronously
+    pin_memory = device.type == "cuda"
+    x = torch.zeros(2,6,3,640,640,pin_memory=pin_memory)
+    rots = torch.zeros(2,6,3,3,pin_memory=pin_memory)
+    trans =torch.zeros(2,6,3,pin_memory=pin_memory)
+    intrins = torch.zeros(2,6,3,3,pin_memory=pin_memory)
     for i in range(3):
         rots[:,:,i,i] = 1
         intrins[:,:,i,i] = 1
+    # camera params stay the same across iterations, copy them once so the lss geometry cache can hit
+    device_rots,device_trans,device_intrins = rots.to(device),trans.to(device),intrins.to(device)
 
-    net1 = BEVerse(grid_confs).to(device)
-    start = time.time()
-    for i in range(100):
-        res1 = net1(x,rots.to(device),trans.to(device),intrins.to(device))
+    net1 = BEVerse(grid_confs).to(device).eval().fuse().compile_convs()
+    with torch.inference_mode(), torch.autocast("cuda",dtype=torch.float16,enabled=use_amp):
+        # torch.compile and cudnn autotuning both happen on the first call, keep them off the clock
+        net1(x.to(device,non_blocking=True),device_rots,device_trans,device_intrins)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.time()
+        for i in range(100):
+            res1 = net1(x.to(device,non_blocking=True),device_rots,device_trans,device_intrins)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
     end = time.time()
     print("FPS:",100/(end-start))
     print([res.shape for res in res1])
-    net2 = BEVerseWithFixedParam(rots,trans,intrins,grid_confs=grid_confs).to(device)
-    start = time.time()
-    for i in range(100):
-        res2 = net2(x)
+    net2 = BEVerseWithFixedParam(rots,trans,intrins,grid_confs=grid_confs).to(device).eval().fuse().compile_convs()
+    with torch.inference_mode(), torch.autocast("cuda",dtype=torch.float16,enabled=use_amp):
+        net2(x.to(device,non_blocking=True))
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.time()
+        for i in range(100):
+            res2 = net2(x.to(device,non_blocking=True))
+    if device.type == "cuda":
+        torch.cuda.synchronize()
     end = time.time()
     print("FPS:",100/(end-start))
-    print([res.shape for res in res2])
\ No newline at end of file
+    print([res.shape for res in res2])
+    if device.type == "cpu":
+        torch.backends.quantized.engine = "fbgemm"
+        # all-zero inputs would give every observer a zero range, calibrate on random images instead
+        net3 = BEVerseWithFixedParam(rots,trans,intrins,grid_confs=grid_confs).eval().fuse().quantize([(torch.rand_like(x),) for i in range(4)])
+        start = time.time()
+        with torch.inference_mode():
+            for i in range(100):
+                res3 = net3(x)
+        end = time.time()
+        print("int8 FPS:",100/(end-start))
+        print([res.shape for res in res3])
\ No newline at end of file
@@ -11,7 +11,7 @@ class Predictor:
         self.config = config
         self.model = BEVerse(config.GRID_CONFIG,num_det_classes=config.NUM_DET_CLASSES,num_seg_classes=config.NUM_SEG_CLASSES,image_size=config.INPUT_IMAGE_SIZE).to(torch.device(config.DEVICE),)
         self.model.load_state_dict(torch.load(config.MODEL_SAVE_PATH,map_location=config.DEVICE))
-        self.model.to(self.config.DEVICE).eval()
+        self.model.to(self.config.DEVICE).eval().fuse().freeze_convs()
         lower_bound, interval, _ = [torch.tensor(res) for res in generate_grid(
                 [config.GRID_CONFIG['det']['xbound'], config.GRID_CONFIG['det']['ybound']])]
         xc = torch.arange(
@@ -20,6 +20,7 @@ class Predictor:
                 lower_bound[1], config.GRID_CONFIG['det']['ybound'][1], interval[1]).to(self.config.DEVICE)
         self.xyc = torch.stack(torch.meshgrid(xc, yc, indexing='ij'), dim=2)
 
+    @torch.inference_mode()
     def predict(self,x,rots,trans,intrins):
         x = torch.tensor(x).to(self.config.DEVICE)
         rots = torch.tensor(rots).to(self.config.DEVICE)
@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+from torch.ao.quantization import fuse_modules
 
 
 __all__ = ['regnetx_002', 'regnetx_004', 'regnetx_006', 'regnetx_008', 'regnetx_016', 'regnetx_032',
@@ -60,6 +61,13 @@ class Bottleneck(nn.Module):
 
         return out
 
+    def fuse(self):
+        # fold each bn into the conv before it, only valid in eval mode
+        fuse_modules(self, [['conv1', 'bn1'], ['conv2', 'bn2'], ['conv3', 'bn3']], inplace=True)
+        if self.downsample is not None:
+            fuse_modules(self.downsample, [['0', '1']], inplace=True)
+        return self
+
 
 class RegNet(nn.Module):
 
@@ -141,7 +149,8 @@ class RegNet(nn.Module):
         x1 = self.layer2(x0)
         x2 = self.layer3(x1)
         x3 = self.layer4(x2)
-        return (x0,x1,x2,x3)
+        # a list rather than a tuple, torchscript can't index a tuple with out_indices
+        return [x0,x1,x2,x3]
 
     def stem(self,x):
         x = self.conv1(x)
@@ -153,6 +162,24 @@ class RegNet(nn.Module):
         feats = self.feats(x)
         return [feats[i] for i in self.out_indices]
 
+    def feature_sizes(self, input_size):
+        '''spatial size (h, w) of every output feature for an input of size (h, w)'''
+        # every strided conv is 3x3 with padding equal to its dilation, so each one is a ceil division
+        h, w = [(s + 1) // 2 for s in input_size]
+        sizes = []
+        for layer in (self.layer1, self.layer2, self.layer3, self.layer4):
+            stride = layer[0].stride
+            h, w = (h + stride - 1) // stride, (w + stride - 1) // stride
+            sizes.append((h, w))
+        return [sizes[i] for i in self.out_indices]
+
+    def fuse(self):
+        fuse_modules(self, [['conv1', 'bn1', 'relu']], inplace=True)
+        for m in self.modules():
+            if isinstance(m, Bottleneck):
+                m.fuse()
+        return self
+
 def regnetx_002(**kwargs):
     return RegNet(Bottleneck, [1, 1, 4, 7], [24, 56, 152, 368], group_width=8, **kwargs)
 
@@ -9,6 +9,10 @@ class VanillaSegmentHead(nn.Module):
     def forward(self,x):
         return self.head(x)
 
+    def fuse(self):
+        self.head.fuse()
+        return self
+
 if __name__ == "__main__":
     x = torch.zeros(4,64,200,400)
     net = VanillaSegmentHead(64,10)
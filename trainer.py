@@ -14,7 +14,7 @@ class Trainer:
         self.model = BEVerse(config.GRID_CONFIG,num_det_classes=config.NUM_DET_CLASSES,num_seg_classes=config.NUM_SEG_CLASSES,image_size=config.INPUT_IMAGE_SIZE).to(torch.device(config.DEVICE),)
         self.epoch = config.EPOCH
         self.dataset = NuScenesDataset()
-        self.dataloader = DataLoader(self.dataset,batch_size=config.BATCH_SIZE)
+        self.dataloader = DataLoader(self.dataset,batch_size=config.BATCH_SIZE,pin_memory=torch.device(config.DEVICE).type == 'cuda')
         self.loss = Loss(gamma1=0,gamma2=0)
         self.optimizer = torch.optim.SGD(self.model.parameters(),config.LEARNING_RATE,config.MOMENTUM)
         self.scheduler = torch.optim.lr_scheduler.StepLR(self.optimizer,step_size=config.LR_SCHE_STEP_SIZE,gamma=config.LR_SCHE_GAMMA)
@@ -32,7 +32,7 @@ class Trainer:
             self.model.train()
             for iter,data in enumerate(self.dataloader):
                 print("training iterateion:",iter)
-                x,rots,trans,intrins,heatmap_gt,regression_gt,segment_gt = [var.to(self.config.DEVICE) for var in data]
+                x,rots,trans,intrins,heatmap_gt,regression_gt,segment_gt = [var.to(self.config.DEVICE,non_blocking=True) for var in data]
                 self.optimizer.zero_grad()
                 predicts = self.model(x,rots,trans,intrins)
                 targets = [heatmap_gt,regression_gt,segment_gt]
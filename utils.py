@@ -1,6 +1,7 @@
 import numpy as np
 import quaternion
 import torch.nn as nn
+from torch.ao.quantization import fuse_modules
 
 def generate_grid(bound):
     lower_bound = np.array(
@@ -29,6 +30,7 @@ class SeparateHead(nn.Module):
     ):
         super().__init__()
 
+        self.bn = bn
         conv_lists = []
         c_in = in_channels
         for i in range(num_convs-1):
@@ -58,4 +60,12 @@ class SeparateHead(nn.Module):
 
     def forward(self, x):   
         ret = self.conv_layers(x)
-        return ret
\ No newline at end of file
+        return ret
+
+    def fuse(self):
+        # fold every conv(+bn)+relu group into one conv, only valid in eval mode
+        step = 3 if self.bn else 2
+        groups = [[str(j) for j in range(i, i+step)] for i in range(0, len(self.conv_layers)-1, step)]
+        if groups:
+            fuse_modules(self.conv_layers, groups, inplace=True)
+        return self